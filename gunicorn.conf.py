@@ -0,0 +1,44 @@
+# gunicorn.conf.py
+# Run one model replica per worker, each pinned to its own GPU:
+#   gunicorn -c gunicorn.conf.py production_app:app
+import os
+import subprocess
+
+def _visible_gpus():
+    """List GPU ids from CUDA_VISIBLE_DEVICES or nvidia-smi (without initializing CUDA)"""
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible is not None:
+        return [gpu.strip() for gpu in visible.split(',') if gpu.strip()]
+    try:
+        result = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    return [str(i) for i, line in enumerate(result.stdout.splitlines()) if line.startswith('GPU')]
+
+GPUS = _visible_gpus()
+# >1 overlaps replicas on one GPU; enable NVIDIA MPS (nvidia-cuda-mps-control -d) for this
+WORKERS_PER_GPU = int(os.environ.get('SETHRY_WORKERS_PER_GPU', '1'))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', max(1, len(GPUS)) * WORKERS_PER_GPU))
+worker_class = 'gthread'
+threads = 8
+timeout = 300  # long generations must not trip the worker watchdog
+preload_app = False  # each worker loads its own model after its GPU is pinned
+
+def pre_fork(server, worker):
+    """Assign the new worker to the GPU with the fewest live workers"""
+    if not GPUS:
+        worker.gpu = None
+        return
+    load = {gpu: 0 for gpu in GPUS}
+    for other in server.WORKERS.values():
+        if getattr(other, 'gpu', None) in load:
+            load[other.gpu] += 1
+    worker.gpu = min(GPUS, key=lambda gpu: load[gpu])
+
+def post_fork(server, worker):
+    """Pin the worker to its GPU before production_app loads the model"""
+    if worker.gpu is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = worker.gpu
+        server.log.info(f"Worker {worker.pid} pinned to GPU {worker.gpu}")
@@ -1,51 +1,165 @@
 # optimized_business_ai.py
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, CompileConfig,
+    DynamicCache, StaticCache, StoppingCriteria, StoppingCriteriaList, StopStringCriteria,
+    TextIteratorStreamer, pipeline
+)
 import logging
 import time
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 import os
+import asyncio
+import atexit
+import contextlib
+import importlib.util
+import queue
+import threading
+from concurrent.futures import Future
+from logging.handlers import QueueHandler, QueueListener
+from types import MappingProxyType
+from uuid import uuid4
+from torch.nn.attention import SDPBackend, sdpa_kernel
+
+try:
+    from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+except ImportError:  # vLLM is optional (Linux + CUDA only)
+    AsyncLLMEngine = None
+
+try:
+    from optimum.onnxruntime import ORTModelForCausalLM
+except ImportError:  # ONNX Runtime backend is optional
+    ORTModelForCausalLM = None
+
+# Allow TF32 / reduced-precision matmuls on GPUs with Tensor Cores
+torch.set_float32_matmul_precision("high")
+
+MODEL_NAME = "Qwen/Qwen3-0.6B"
+# Output of `optimum-cli export onnx` (see README); resolved next to this file, not the working directory
+ONNX_MODEL_DIR = os.environ.get(
+    "SETHRY_ONNX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "qwen3-onnx")
+)
+BATCH_CHUNK_SIZE = 16  # max prompts per padded micro-batch in batch_generate
+MAX_PROMPT_LEN = 1024  # prompt tokens kept per request; longer prompts are cut
+MAX_CACHE_LEN = 1536  # MAX_PROMPT_LEN prompt tokens + 512 new tokens
+MAX_COALESCE_BATCH = 8  # max concurrent requests merged into one generate call
+MAX_COALESCE_WAIT_MS = 25  # how long the first request waits for others to join
+MAX_INFLIGHT = 64  # concurrent generations; cleanup() waits for all of them
+
+# System context for each business category
+CONTEXT_PROMPTS = MappingProxyType({
+    "general": "You are a business consultant specializing in helping MSMEs. Provide practical, actionable advice.",
+    "finance": "You are a financial advisor for small businesses. Focus on cash flow management, budgeting, and financial planning.",
+    "marketing": "You are a marketing consultant for small businesses. Provide strategies for digital marketing, branding, and customer acquisition.",
+    "operations": "You are an operations consultant for MSMEs. Focus on process improvement, efficiency, and resource optimization.",
+    "hr": "You are an HR consultant for small businesses. Provide guidance on employee management, recruitment, and workplace culture."
+})
+# Prompt layout: context + QUESTION_PREFIX + question + ANSWER_SUFFIX
+QUESTION_PREFIX = " Question: "
+ANSWER_SUFFIX = "\n\nAnswer:"
+# Prompt text up to the question, built once per category
+PROMPT_PREFIX = MappingProxyType({k: v + QUESTION_PREFIX for k, v in CONTEXT_PROMPTS.items()})
+# Default cap on generated tokens per category; decode time is linear in output length
+MAX_NEW_TOKENS = MappingProxyType({
+    "finance": 256,
+    "hr": 192,
+    "operations": 256,
+    "marketing": 256,
+    "general": 320
+})
+# The model starts a new Q&A turn after its answer; stop generating there
+STOP_STRINGS = ("\n\nQuestion:", "\n\nAnswer:")
+
+_log_listener = None
+
+def configure_logging(level=logging.INFO):
+    """
+    Send log records through a queue to a background listener thread, so the
+    stream writes happen there instead of on request threads (records are still
+    formatted by QueueHandler on the emitting thread)
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return
+    
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue(-1)
+    _log_listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+    
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+class ServiceShuttingDown(RuntimeError):
+    """
+    Raised for requests that arrive or are still queued once cleanup() has started
+    """
+
+class EventStoppingCriteria(StoppingCriteria):
+    """
+    Stop generation once an event is set, e.g. when a streaming client disconnects
+    """
+    def __init__(self, event: threading.Event):
+        self.event = event
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
 
 class OptimizedBusinessConsultingAI:
-    def __init__(self, access_token=None):
+    def __init__(self, access_token=None, backend: str = "auto", draft_model: Optional[str] = None,
+                 quantize: bool = True):
         """
         Initialize the Business Consulting AI with optimized settings for MSME use cases
+
+        Args:
+            access_token (str): Hugging Face access token
+            backend (str): "vllm", "hf", "onnx" or "auto" (vLLM when installed and CUDA is available)
+            draft_model (str): Optional small model for speculative (assisted) decoding on the HF backend
+            quantize (bool): Load 4-bit NF4 weights on GPU (HF backend); False keeps FP16 weights
+                and runs the decode step as a compiled CUDA graph instead
         """
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # BF16 halves memory vs FP32 on CPU and runs on AVX512-BF16/AMX matmul units
+        self.dtype = torch.float16 if torch.cuda.is_available() else torch.bfloat16
         self.access_token = access_token
         
         # Configure logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
+        configure_logging()
         self.logger = logging.getLogger(__name__)
         
+        if backend == "auto":
+            backend = "vllm" if AsyncLLMEngine is not None and torch.cuda.is_available() else "hf"
+        self.backend = backend
+        self.model = None
+        self.tokenizer = None
+        self.engine = None
+        self.kv_cache = None
+        self.assistant_model = None
+        self.assistant_tokenizer = None
+        self.attn_implementation = None
+        self._input_buffer = None
+        self._loop = None
+        # One model, one KV cache: HF generate calls run one at a time
+        self._generate_lock = threading.Lock()
+        # Shutdown bookkeeping: cleanup() drains in-flight requests before freeing the model
+        self._inflight = threading.Semaphore(MAX_INFLIGHT)
+        self._shutdown = threading.Event()
+        self._cleanup_lock = threading.Lock()
+        
         try:
-            self.logger.info(f"Initializing AI model on {self.device}")
-            
-            # Load tokenizer and model with optimized settings
-            model_name = "Qwen/Qwen3-0.6B"
-            
-            # Set up proper loading parameters for web deployment
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                model_name,
-                token=access_token,
-                trust_remote_code=True
-            )
-            
-            # Load model with memory optimization
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                token=access_token,
-                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-                device_map="auto" if torch.cuda.is_available() else None,
-                low_cpu_mem_usage=True
-            )
+            self.logger.info(f"Initializing AI model on {self.device} (backend: {self.backend})")
+            if draft_model and self.backend in ("vllm", "onnx"):
+                self.logger.warning(f"Ignoring draft model {draft_model}: assisted decoding needs the hf backend")
             
-            # Add padding token if not exists
-            if self.tokenizer.pad_token is None:
-                self.tokenizer.pad_token = self.tokenizer.eos_token
+            if self.backend == "vllm":
+                self._load_vllm_engine(access_token)
+            elif self.backend == "onnx":
+                self._load_onnx_model(access_token)
+            else:
+                self._load_hf_model(access_token, draft_model, quantize)
                 
             self.logger.info("✅ AI model loaded successfully!")
             
@@ -53,6 +167,370 @@ class OptimizedBusinessConsultingAI:
             self.logger.error(f"❌ Failed to initialize AI model: {str(e)}")
             raise
     
+    def _load_tokenizer(self, access_token):
+        """
+        Load the tokenizer shared by all backends
+        """
+        # Set up proper loading parameters for web deployment
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            MODEL_NAME,
+            token=access_token,
+            trust_remote_code=True,
+            use_fast=True
+        )
+        
+        # Add padding token if not exists
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Decoder-only models need left padding for batched generation
+        self.tokenizer.padding_side = "left"
+        
+        self._stopping_criteria = StoppingCriteriaList([
+            StopStringCriteria(self.tokenizer, list(STOP_STRINGS))
+        ])
+        
+        # Single-question inputs are staged in reused buffers: question ids go
+        # through pinned host memory for an async copy, and the all-ones
+        # attention mask lives on the device and is only sliced
+        if self.device.type == "cuda":
+            self._input_buffer = torch.empty((1, MAX_PROMPT_LEN), dtype=torch.long, pin_memory=True)
+        self._attention_mask = torch.ones((1, MAX_CACHE_LEN), dtype=torch.long, device=self.device)
+    
+    def _load_hf_model(self, access_token, draft_model=None, quantize=True):
+        """
+        Load the tokenizer and model with HuggingFace Transformers
+        """
+        self._load_tokenizer(access_token)
+        
+        # Decode is bound by weight reads, so on GPU load 4-bit NF4 weights
+        # (0.5 bytes/param instead of 2) and compute in FP16
+        quantization_config = None
+        if quantize and torch.cuda.is_available():
+            quantization_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_use_double_quant=True
+            )
+        
+        # Pre-allocate the KV cache once instead of growing a fresh one on every call.
+        # Assisted decoding rolls back rejected draft tokens, which needs a dynamic cache,
+        # and bitsandbytes 4-bit models cannot be compiled, so without the CUDA graph
+        # a static cache would only add masking work over unused slots.
+        use_static_cache = self.device.type == "cuda" and not draft_model and quantization_config is None
+        
+        # Fused attention that never materializes the full score matrix:
+        # FlashAttention-2 when flash-attn is installed, PyTorch SDPA otherwise.
+        # FlashAttention-2 drops an all-ones mask and would attend over every
+        # unwritten static cache slot, so the static cache always uses SDPA.
+        if (torch.cuda.is_available() and not use_static_cache
+                and importlib.util.find_spec("flash_attn") is not None):
+            self.attn_implementation = "flash_attention_2"
+        else:
+            self.attn_implementation = "sdpa"
+        
+        # Load model with memory optimization
+        self.model = AutoModelForCausalLM.from_pretrained(
+            MODEL_NAME,
+            token=access_token,
+            torch_dtype=self.dtype,
+            device_map="auto" if torch.cuda.is_available() else None,
+            quantization_config=quantization_config,
+            attn_implementation=self.attn_implementation,
+            low_cpu_mem_usage=True
+        )
+        
+        self.model.eval()
+        torch.backends.cudnn.benchmark = True
+        
+        if draft_model:
+            self._load_draft_model(draft_model, access_token)
+        
+        self._build_context_cache()
+        
+        if use_static_cache:
+            self.kv_cache = StaticCache(
+                config=self.model.config,
+                max_batch_size=1,
+                max_cache_len=MAX_CACHE_LEN,
+                device=self.device,
+                dtype=self.model.dtype
+            )
+            
+            # With a static cache, generate runs the decode step through torch.compile;
+            # "reduce-overhead" captures it as a CUDA graph so each token is one replay
+            self.model.generation_config.compile_config = CompileConfig(
+                fullgraph=True,
+                dynamic=False,
+                mode="reduce-overhead"
+            )
+        
+        self._warmup()
+    
+    def _load_draft_model(self, draft_model, access_token):
+        """
+        Load a small draft model that proposes tokens for the main model to verify
+        
+        Each accepted draft token skips one full read of the main model's weights.
+        HF's assisted generation keeps sampling from the main model's distribution.
+        """
+        self.assistant_model = AutoModelForCausalLM.from_pretrained(
+            draft_model,
+            token=access_token,
+            torch_dtype=self.dtype,
+            device_map="auto" if torch.cuda.is_available() else None,
+            low_cpu_mem_usage=True
+        )
+        self.assistant_model.eval()
+        self.assistant_model.generation_config.num_assistant_tokens = 5
+        
+        # A draft with a different tokenizer needs it passed along (universal assisted decoding);
+        # equal vocab sizes do not imply the same token ids, so compare the vocabularies
+        draft_tokenizer = AutoTokenizer.from_pretrained(draft_model, token=access_token)
+        if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            self.assistant_tokenizer = draft_tokenizer
+        self.logger.info(f"Loaded draft model {draft_model} for assisted decoding")
+    
+    def _load_onnx_model(self, access_token):
+        """
+        Load the exported ONNX graph with ONNX Runtime, which runs the transformer
+        as fused kernels and binds inputs/outputs directly on the GPU
+        """
+        if ORTModelForCausalLM is None:
+            raise RuntimeError("ONNX backend requested but optimum[onnxruntime] is not installed")
+        
+        self._load_tokenizer(access_token)
+        
+        use_cuda = self.device.type == "cuda"
+        self.model = ORTModelForCausalLM.from_pretrained(
+            ONNX_MODEL_DIR,
+            provider="CUDAExecutionProvider" if use_cuda else "CPUExecutionProvider",
+            use_io_binding=use_cuda
+        )
+        
+        self._build_context_cache()
+        self._warmup()
+    
+    def _build_context_cache(self):
+        """
+        Tokenize each category context once and prefill its KV, so requests
+        only tokenize and prefill their own question
+        """
+        self._context_ids = {}
+        self._context_kv = {}
+        for category, context in CONTEXT_PROMPTS.items():
+            context_ids = self.tokenizer(context, return_tensors="pt")['input_ids'].to(self.device)
+            self._context_ids[category] = context_ids
+            # ONNX Runtime keeps its own KV buffers, so only the PyTorch model reuses prefix KV
+            if self.backend == "hf":
+                with self._inference_context():
+                    prefix_cache = self.model(input_ids=context_ids, use_cache=True).past_key_values
+                self._context_kv[category] = tuple(prefix_cache[i] for i in range(len(prefix_cache)))
+    
+    def _restore_context_cache(self, category: str):
+        """
+        Return a KV cache pre-filled with the category context
+        
+        Reuses the pre-allocated static cache when there is one, otherwise
+        starts a fresh dynamic cache from the stored prefix tensors.
+        """
+        if self.kv_cache is not None:
+            self.kv_cache.reset()
+            cache = self.kv_cache
+        else:
+            cache = DynamicCache()
+        
+        prefix_kv = self._context_kv[category]
+        cache_position = torch.arange(prefix_kv[0][0].shape[-2], device=self.device)
+        for layer_idx, (keys, values) in enumerate(prefix_kv):
+            cache.update(keys, values, layer_idx, {"cache_position": cache_position})
+        return cache
+    
+    def _inference_context(self):
+        """
+        Context for HF generate calls: no autograd, autocast to the inference dtype
+        """
+        stack = contextlib.ExitStack()
+        stack.enter_context(torch.no_grad())
+        stack.enter_context(torch.autocast(device_type=self.device.type, dtype=self.dtype))
+        if self.device.type == "cuda" and self.attn_implementation == "sdpa":
+            # Prefer the flash / memory-efficient kernels; keep math as the last resort for
+            # GQA calls on pre-sm80 GPUs, which neither fused kernel accepts
+            stack.enter_context(sdpa_kernel(
+                [SDPBackend.FLASH_ATTENTION, SDPBackend.EFFICIENT_ATTENTION, SDPBackend.MATH]
+            ))
+        return stack
+    
+    def _warmup(self):
+        """
+        Run a short generation at boot so lazy initialization, compilation and
+        CUDA graph capture happen before the first user request
+        """
+        self.logger.info("Warming up model...")
+        self._generate_single("Warmup.", "general", max_length=16)
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+    
+    def _load_vllm_engine(self, access_token):
+        """
+        Start a vLLM engine (PagedAttention + continuous batching) on a background event loop.
+        
+        Flask request threads submit prompts to this loop, so concurrent requests are
+        batched by vLLM instead of serializing on a single model.
+        """
+        if AsyncLLMEngine is None:
+            raise RuntimeError("vLLM backend requested but vllm is not installed")
+        if access_token:
+            os.environ.setdefault("HF_TOKEN", access_token)
+        
+        # Prompts are tokenized here so they get the same length budget as the HF path
+        self._load_tokenizer(access_token)
+        
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="vllm-engine-loop", daemon=True).start()
+        
+        engine_args = AsyncEngineArgs(
+            model=MODEL_NAME,
+            dtype="float16",
+            enable_prefix_caching=True,  # category system prompts are shared prefixes
+            gpu_memory_utilization=0.9,
+            max_model_len=MAX_CACHE_LEN
+        )
+        
+        async def create_engine():
+            return AsyncLLMEngine.from_engine_args(engine_args)
+        
+        self.engine = self._run_on_engine_loop(create_engine()).result()
+    
+    def _run_on_engine_loop(self, coro):
+        """
+        Schedule a coroutine on the vLLM event loop and return a concurrent Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+    
+    def _vllm_prompt(self, prompt: str) -> Dict:
+        """
+        Tokenize a prompt for vLLM, cut to MAX_PROMPT_LEN tokens so long questions
+        are truncated instead of rejected by the engine
+        """
+        return {"prompt_token_ids": self.tokenizer(prompt)['input_ids'][:MAX_PROMPT_LEN]}
+    
+    async def _vllm_generate(self, prompt: str, max_tokens: int) -> str:
+        """
+        Run a single prompt through the vLLM engine and return the final text
+        """
+        sampling_params = SamplingParams(
+            temperature=0.7, top_p=0.9, max_tokens=max_tokens, stop=list(STOP_STRINGS)
+        )
+        final_output = None
+        async for output in self.engine.generate(self._vllm_prompt(prompt), sampling_params, request_id=uuid4().hex):
+            final_output = output
+        return final_output.outputs[0].text.strip()
+    
+    def _vllm_stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        """
+        Relay text deltas from the vLLM engine loop to the calling thread
+        """
+        chunks = queue.Queue()
+        request_id = uuid4().hex
+        
+        async def pump():
+            sampling_params = SamplingParams(
+                temperature=0.7, top_p=0.9, max_tokens=max_tokens, stop=list(STOP_STRINGS)
+            )
+            sent = 0
+            try:
+                async for output in self.engine.generate(self._vllm_prompt(prompt), sampling_params,
+                                                         request_id=request_id):
+                    text = output.outputs[0].text
+                    chunks.put(text[sent:])
+                    sent = len(text)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(None)
+        
+        self._run_on_engine_loop(pump())
+        finished = False
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    finished = True
+                    return
+                if isinstance(chunk, Exception):
+                    finished = True
+                    raise chunk
+                if chunk:
+                    yield chunk
+        finally:
+            if not finished:
+                # The consumer went away (client disconnect): free the engine's slot
+                self._run_on_engine_loop(self.engine.abort(request_id)).result()
+    
+    async def _vllm_batch_generate(self, prompts: List[str], max_tokens: int) -> List[str]:
+        """
+        Submit all prompts at once so the engine schedules them in the same batches
+        """
+        return await asyncio.gather(*(self._vllm_generate(p, max_tokens) for p in prompts))
+    
+    def _context_key(self, category: str) -> str:
+        """
+        Map a request category to a CONTEXT_PROMPTS key, falling back to general
+        """
+        category = category.lower()
+        return category if category in CONTEXT_PROMPTS else "general"
+    
+    def _question_suffix(self, question: str) -> str:
+        """
+        The per-request part of the prompt that follows the category context
+        """
+        return QUESTION_PREFIX + question + ANSWER_SUFFIX
+    
+    def _max_new_tokens(self, category: str, max_length: int) -> int:
+        """
+        Cap the requested response length by the category default
+        """
+        return min(max_length, MAX_NEW_TOKENS[self._context_key(category)])
+    
+    def _trim_stop_strings(self, text: str) -> str:
+        """
+        Cut generated text at the first stop string
+        """
+        for stop in STOP_STRINGS:
+            index = text.find(stop)
+            if index != -1:
+                text = text[:index]
+        return text.strip()
+    
+    def _stop_filtered(self, chunks: Iterator[str]) -> Iterator[str]:
+        """
+        Relay streamed text up to the first stop string
+        
+        Holds back just enough trailing text to catch a stop string that is
+        split across chunks.
+        """
+        hold = max(len(stop) for stop in STOP_STRINGS) - 1
+        buffer = ""
+        for chunk in chunks:
+            buffer += chunk
+            indices = [i for i in (buffer.find(stop) for stop in STOP_STRINGS) if i != -1]
+            if indices:
+                if min(indices) > 0:
+                    yield buffer[:min(indices)]
+                return
+            if len(buffer) > hold:
+                yield buffer[:-hold]
+                buffer = buffer[-hold:]
+        if buffer:
+            yield buffer
+    
+    def _build_prompt(self, question: str, category: str) -> str:
+        """
+        Build the model prompt with the category-specific consulting context
+        """
+        return PROMPT_PREFIX[self._context_key(category)] + question + ANSWER_SUFFIX
+    
     def generate_response(self, question: str, category: str = "general", max_length: int = 512) -> str:
         """
         Generate a business consulting response based on the question and category
@@ -66,72 +544,236 @@ class OptimizedBusinessConsultingAI:
             str: Generated business consulting response
         """
         try:
-            # Add context based on category
-            context_prompts = {
-                "general": "You are a business consultant specializing in helping MSMEs. Provide practical, actionable advice.",
-                "finance": "You are a financial advisor for small businesses. Focus on cash flow management, budgeting, and financial planning.",
-                "marketing": "You are a marketing consultant for small businesses. Provide strategies for digital marketing, branding, and customer acquisition.",
-                "operations": "You are an operations consultant for MSMEs. Focus on process improvement, efficiency, and resource optimization.",
-                "hr": "You are an HR consultant for small businesses. Provide guidance on employee management, recruitment, and workplace culture."
-            }
-            
-            # Build prompt with context
-            context = context_prompts.get(category.lower(), context_prompts["general"])
-            prompt = f"{context} Question: {question}\n\nAnswer:"
-            
-            self.logger.info(f"Processing question in category '{category}': {question[:50]}...")
-            
-            # Tokenize input
-            inputs = self.tokenizer(
-                prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=1024,
-                padding=True
-            ).to(self.device)
-            
-            # Generate response with optimized parameters
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_length,
-                    temperature=0.7,
-                    top_p=0.9,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.pad_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id
-                )
-            
-            # Decode response
-            generated_text = self.tokenizer.decode(
-                outputs[0][inputs['input_ids'].shape[1]:], 
-                skip_special_tokens=True
-            ).strip()
-            
-            self.logger.info("Response generated successfully")
-            return generated_text
-            
+            with self._track_request():
+                if self.logger.isEnabledFor(logging.INFO):
+                    self.logger.info("Processing question in category '%s': %.50s...", category, question)
+                max_length = self._max_new_tokens(category, max_length)
+                
+                if self.backend == "vllm":
+                    # vLLM's prefix caching reuses the context KV blocks automatically
+                    generated_text = self._run_on_engine_loop(
+                        self._vllm_generate(self._build_prompt(question, category), max_length)
+                    ).result()
+                    self.logger.info("Response generated successfully")
+                    return generated_text
+                    
+                generated_text = self._generate_single(question, category, max_length)
+                
+                self.logger.info("Response generated successfully")
+                return generated_text
+                
+        except ServiceShuttingDown:
+            raise
         except Exception as e:
             error_msg = f"Error generating response: {str(e)}"
             self.logger.error(error_msg)
             return f"Sorry, I encountered an error processing your request: {str(e)}"
     
-    def batch_generate(self, questions: List[str], category: str = "general") -> List[str]:
+    @contextlib.contextmanager
+    def _track_request(self):
+        """
+        Count a generation as in flight, refusing new work once shutdown has started
+        """
+        if self._shutdown.is_set():
+            raise ServiceShuttingDown("Service is shutting down")
+        with self._inflight:
+            if self._shutdown.is_set():
+                raise ServiceShuttingDown("Service is shutting down")
+            yield
+    
+    @property
+    def is_shutting_down(self) -> bool:
+        return self._shutdown.is_set()
+    
+    def _generate_single(self, question: str, category: str, max_length: int,
+                         streamer: Optional[TextIteratorStreamer] = None,
+                         cancel: Optional[threading.Event] = None) -> str:
         """
-        Generate responses for multiple questions
+        Answer one question on the HF model, starting from the cached category prefix
+        """
+        # Only the question is tokenized; the context ids and KV are cached.
+        # The ids are cut here rather than with truncation=True: a per-category
+        # max_length would rewrite the shared Rust tokenizer's truncation state
+        # on every call, racing with other request threads.
+        context_key = self._context_key(category)
+        context_ids = self._context_ids[context_key]
+        question_ids = self.tokenizer(
+            self._question_suffix(question),
+            add_special_tokens=False
+        )['input_ids'][:MAX_PROMPT_LEN - context_ids.shape[1]]
+        
+        # Generate response with optimized parameters
+        with self._generate_lock, self._inference_context():
+            # The staging buffer is shared, so fill it under the generate lock
+            if self._input_buffer is not None:
+                staged = self._input_buffer[:, :len(question_ids)]
+                staged.numpy()[0] = question_ids
+                question_tensor = staged.to(self.device, non_blocking=True)
+            else:
+                question_tensor = torch.tensor([question_ids], device=self.device)
+            input_ids = torch.cat([context_ids, question_tensor], dim=1)
+            inputs = {'input_ids': input_ids, 'attention_mask': self._attention_mask[:, :input_ids.shape[1]]}
+            
+            cache_kwargs = {}
+            if self._context_kv:
+                cache_kwargs = {"past_key_values": self._restore_context_cache(context_key), "use_cache": True}
+            stopping_criteria = self._stopping_criteria
+            if cancel is not None:
+                stopping_criteria = StoppingCriteriaList([*stopping_criteria, EventStoppingCriteria(cancel)])
+            assist_kwargs = {}
+            if self.assistant_model is not None:
+                assist_kwargs = {"assistant_model": self.assistant_model}
+                if self.assistant_tokenizer is not None:
+                    assist_kwargs.update(tokenizer=self.tokenizer, assistant_tokenizer=self.assistant_tokenizer)
+            outputs = self.model.generate(
+                **inputs,
+                **cache_kwargs,
+                **assist_kwargs,
+                streamer=streamer,
+                stopping_criteria=stopping_criteria,
+                # Never run past the end of the pre-allocated cache
+                max_new_tokens=min(max_length, MAX_CACHE_LEN - input_ids.shape[1]),
+                temperature=0.7,
+                top_p=0.9,
+                do_sample=True,
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id
+            )
+        
+        # Decode response: slice off the prompt on device, move only the new tokens to host
+        prompt_len = inputs['input_ids'].shape[1]
+        texts = self.tokenizer.batch_decode(
+            outputs[:, prompt_len:].cpu(),
+            skip_special_tokens=True
+        )
+        return self._trim_stop_strings(texts[0])
+    
+    def stream_response(self, question: str, category: str = "general", max_length: int = 512) -> Iterator[str]:
+        """
+        Generate a business consulting response, yielding text as it is decoded
+        
+        Args:
+            question (str): The business question to answer
+            category (str): Business category for context (e.g., finance, marketing, operations)
+            max_length (int): Maximum length of generated response
+            
+        Yields:
+            str: The next piece of the response
+        """
+        with self._track_request():
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("Streaming question in category '%s': %.50s...", category, question)
+            max_length = self._max_new_tokens(category, max_length)
+            
+            if self.backend == "vllm":
+                yield from self._vllm_stream(self._build_prompt(question, category), max_length)
+                return
+                
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            cancel = threading.Event()
+            errors = []
+            
+            def run():
+                try:
+                    self._generate_single(question, category, max_length, streamer=streamer, cancel=cancel)
+                except Exception as e:
+                    errors.append(e)
+                    streamer.end()
+                    
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            try:
+                yield from self._stop_filtered(streamer)
+            finally:
+                # Stop decoding if the consumer went away, and keep this request
+                # in flight until the worker has released the model
+                cancel.set()
+                thread.join()
+            if errors:
+                raise errors[0]
+    
+    def batch_generate(self, questions: List[str], category: str = "general", max_length: int = 512) -> List[str]:
+        """
+        Generate responses for multiple questions in a single batched generate call
         
         Args:
             questions (List[str]): List of business questions
             category (str): Business category for context
+            max_length (int): Maximum length of each generated response
             
         Returns:
             List[str]: List of generated responses
         """
-        responses = []
-        for question in questions:
-            response = self.generate_response(question, category)
-            responses.append(response)
-        return responses
+        if not questions:
+            return []
+            
+        try:
+            with self._track_request():
+                max_length = self._max_new_tokens(category, max_length)
+                prompts = [self._build_prompt(q, category) for q in questions]
+                
+                if self.backend == "vllm":
+                    return self._run_on_engine_loop(
+                        self._vllm_batch_generate(prompts, max_length)
+                    ).result()
+                    
+                # Sort by token length and run similar-length chunks together so each
+                # chunk only pads to its own longest prompt
+                encoded = [ids[:MAX_PROMPT_LEN] for ids in self.tokenizer(prompts)['input_ids']]
+                order = sorted(range(len(prompts)), key=lambda i: len(encoded[i]))
+                
+                responses = [None] * len(prompts)
+                for start in range(0, len(order), BATCH_CHUNK_SIZE):
+                    chunk = order[start:start + BATCH_CHUNK_SIZE]
+                    chunk_responses = self._generate_chunk([encoded[i] for i in chunk], max_length)
+                    for i, response in zip(chunk, chunk_responses):
+                        responses[i] = response
+                return responses
+                
+        except ServiceShuttingDown:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error generating batch response: {str(e)}")
+            return [f"Sorry, I encountered an error processing your request: {str(e)}"] * len(questions)
+    
+    def _generate_chunk(self, input_ids: List[List[int]], max_length: int) -> List[str]:
+        """
+        Run one left-padded generate call over pre-tokenized prompts
+        """
+        # Left-pad so every prompt ends right where generation starts
+        inputs = self.tokenizer.pad(
+            {'input_ids': input_ids},
+            padding=True,
+            return_tensors="pt"
+        )
+        # Pin the padded batch so the host-to-device copy is actually asynchronous
+        if self.device.type == "cuda":
+            inputs = {name: tensor.pin_memory().to(self.device, non_blocking=True)
+                      for name, tensor in inputs.items()}
+        else:
+            inputs = inputs.to(self.device)
+        
+        # Chunk sizes vary from call to call and a static cache is rebuilt (and its
+        # decode graph recaptured) for every new batch size, so padded batches
+        # keep the default dynamic cache
+        with self._generate_lock, self._inference_context():
+            outputs = self.model.generate(
+                **inputs,
+                stopping_criteria=self._stopping_criteria,
+                max_new_tokens=max_length,
+                temperature=0.7,
+                top_p=0.9,
+                do_sample=True,
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id
+            )
+        
+        prompt_len = inputs['input_ids'].shape[1]
+        responses = self.tokenizer.batch_decode(
+            outputs[:, prompt_len:].cpu(),
+            skip_special_tokens=True
+        )
+        return [self._trim_stop_strings(response) for response in responses]
     
     def get_model_info(self) -> Dict:
         """
@@ -145,30 +787,127 @@ class OptimizedBusinessConsultingAI:
                 config = self.model.config
                 return {
                     "model_name": config._name_or_path,
+                    "backend": self.backend,
                     "device": str(self.device),
-                    "torch_dtype": str(self.model.dtype),
-                    "parameters": f"{self.model.num_parameters() / 1e6:.2f}M"
+                    "torch_dtype": str(getattr(self.model, 'dtype', self.dtype)),
+                    "parameters": f"{self.model.num_parameters() / 1e6:.2f}M" if hasattr(self.model, 'num_parameters') else "unknown"
                 }
             else:
                 return {
                     "model_name": "Qwen3-0.6B",
+                    "backend": self.backend,
                     "device": str(self.device),
                     "torch_dtype": str(self.model.dtype) if hasattr(self.model, 'dtype') else "unknown"
                 }
         except Exception as e:
             return {"error": f"Could not retrieve model info: {str(e)}"}
     
-    def cleanup(self):
+    def cleanup(self, timeout: float = 30.0):
         """
         Clean up resources when shutting down
+        
+        Safe to call more than once. New requests are refused, in-flight ones get up
+        to `timeout` seconds to finish, then the model is released.
         """
+        with self._cleanup_lock:
+            if self._shutdown.is_set():
+                return
+            self._shutdown.set()
+        
         try:
+            # Wait for in-flight generations by taking every permit
+            deadline = time.monotonic() + timeout
+            for _ in range(MAX_INFLIGHT):
+                if not self._inflight.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    self.logger.warning("Timed out waiting for in-flight requests to finish")
+                    break
+            
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            self.engine = None
+            self.model = None
+            self.assistant_model = None
+            self.kv_cache = None
+            self._context_kv = {}
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
             self.logger.info("Resources cleaned up successfully")
         except Exception as e:
             self.logger.error(f"Error during cleanup: {str(e)}")
 
+class RequestBatcher:
+    """
+    Coalesce concurrent single-question requests into batched generate calls
+    
+    Request threads enqueue their question and block on a Future; a worker thread
+    collects up to MAX_COALESCE_BATCH requests (waiting at most MAX_COALESCE_WAIT_MS
+    after the first), groups them by category and answers each group with one
+    batch_generate call.
+    """
+    def __init__(self, consultant: OptimizedBusinessConsultingAI,
+                 max_batch_size: int = MAX_COALESCE_BATCH, max_wait_ms: int = MAX_COALESCE_WAIT_MS):
+        self.consultant = consultant
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="request-batcher", daemon=True)
+        self._worker.start()
+    
+    def submit(self, question: str, category: str = "general", max_length: int = 512) -> Future:
+        """
+        Queue a question and return a Future resolved with its response
+        """
+        future = Future()
+        self._queue.put((question, category, max_length, future))
+        return future
+    
+    def generate_response(self, question: str, category: str = "general", max_length: int = 512) -> str:
+        """
+        Blocking counterpart of OptimizedBusinessConsultingAI.generate_response
+        """
+        return self.submit(question, category, max_length).result()
+    
+    def _collect(self) -> List:
+        """
+        Wait for one request, then gather more until the batch is full or the wait expires
+        """
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+    
+    def _run(self):
+        while True:
+            groups = {}
+            for item in self._collect():
+                question, category, max_length, future = item
+                # Group on the capped length generation will use, not the raw request value
+                key = (self.consultant._context_key(category),
+                       self.consultant._max_new_tokens(category, max_length))
+                groups.setdefault(key, []).append(item)
+            
+            for (category, max_length), items in groups.items():
+                try:
+                    if len(items) == 1:
+                        # A lone request keeps the cached-prefix single-question path
+                        responses = [self.consultant.generate_response(items[0][0], category, max_length)]
+                    else:
+                        responses = self.consultant.batch_generate(
+                            [item[0] for item in items], category, max_length
+                        )
+                    for item, response in zip(items, responses):
+                        item[3].set_result(response)
+                except Exception as e:
+                    for item in items:
+                        item[3].set_exception(e)
+
 # Example usage for testing
 if __name__ == "__main__":
     # This is for testing purposes only - not used in web app
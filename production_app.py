@@ -1,41 +1,42 @@
 # production_app.py
 import torch
-from flask import Flask, render_template, request, jsonify
-from optimized_business_ai import OptimizedBusinessConsultingAI
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+from optimized_business_ai import (
+    CONTEXT_PROMPTS, OptimizedBusinessConsultingAI, RequestBatcher, ServiceShuttingDown, configure_logging
+)
 import time
+import atexit
 import logging
+import os
 import signal
 import sys
 import json
+from contextlib import closing
 from datetime import datetime
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this to a secure random key
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Global variable to track if we're shutting down
-shutdown_flag = False
-
-# Handle graceful shutdown
-def signal_handler(sig, frame):
-    logger.info('Received shutdown signal...')
-    global shutdown_flag
-    shutdown_flag = True
-    sys.exit(0)
-
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
+VALID_CATEGORIES = frozenset(CONTEXT_PROMPTS)
+DEFAULT_MAX_TOKENS = 256  # further capped per category by the consultant
 
 # Initialize AI with GPU optimization
 try:
     access_token = "hf_"
-    consultant = OptimizedBusinessConsultingAI(access_token=access_token)
+    consultant = OptimizedBusinessConsultingAI(
+        access_token=access_token,
+        backend=os.environ.get('SETHRY_BACKEND', 'auto'),
+        draft_model=os.environ.get('SETHRY_DRAFT_MODEL'),
+        quantize=os.environ.get('SETHRY_QUANTIZE', '1') != '0'
+    )
+    # vLLM batches concurrent requests itself; the HF backend coalesces them here
+    request_batcher = RequestBatcher(consultant) if consultant.backend != "vllm" else None
+    # Runs on interpreter exit (WSGI server shutdown); waits for in-flight requests
+    atexit.register(consultant.cleanup)
     logger.info("🚀 Production App Ready with GPU Optimization!")
 except Exception as e:
     logger.error(f"❌ Failed to initialize: {str(e)}")
@@ -49,7 +50,7 @@ def home():
 @app.route('/api/consult', methods=['GET'])
 def consult():
     """API endpoint for business consulting questions"""
-    if shutdown_flag:
+    if consultant.is_shutting_down:
         return jsonify({'error': 'Service is shutting down'}), 503
     
     question = request.args.get('question', '').strip()
@@ -59,23 +60,42 @@ def consult():
         return jsonify({'error': 'Question parameter is required'}), 400
     
     # Validate category
-    valid_categories = ['general', 'finance', 'marketing', 'operations', 'hr']
-    if category not in valid_categories:
+    if category not in VALID_CATEGORIES:
         category = 'general'
     
+    max_tokens = parse_max_tokens(request.args.get('max_tokens', DEFAULT_MAX_TOKENS))
+    if max_tokens is None:
+        return jsonify({'error': 'max_tokens must be a positive integer'}), 400
+    
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return Response(
+            stream_with_context(stream_consultation(question, category, max_tokens)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
     try:
         start_time = time.time()
         
         # Generate response using the AI model
-        response = consultant.generate_response(
-            question=question,
-            category=category
-        )
+        if request_batcher is not None:
+            response = request_batcher.generate_response(
+                question=question,
+                category=category,
+                max_length=max_tokens
+            )
+        else:
+            response = consultant.generate_response(
+                question=question,
+                category=category,
+                max_length=max_tokens
+            )
         
         end_time = time.time()
         processing_time = round(end_time - start_time, 2)
         
-        logger.info(f"Consultation completed in {processing_time}s for: {question[:50]}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Consultation completed in %ss for: %.50s...", processing_time, question)
         
         return jsonify({
             'question': question,
@@ -85,15 +105,45 @@ def consult():
             'timestamp': datetime.now().isoformat()
         })
         
+    except ServiceShuttingDown:
+        # Requests still queued in the batcher when shutdown started
+        return jsonify({'error': 'Service is shutting down'}), 503
     except Exception as e:
         error_msg = f"Error processing consultation: {str(e)}"
         logger.error(error_msg)
         return jsonify({'error': f'Failed to process request: {str(e)}'}), 500
 
+def parse_max_tokens(value):
+    """Parse the max_tokens parameter, returning None if it is not a positive integer"""
+    try:
+        max_tokens = int(value)
+    except (TypeError, ValueError):
+        return None
+    return max_tokens if max_tokens > 0 else None
+
+def stream_consultation(question, category, max_tokens):
+    """Yield Server-Sent Events with response text as it is generated"""
+    start_time = time.time()
+    try:
+        # closing() stops generation as soon as the client disconnects
+        with closing(consultant.stream_response(question=question, category=category, max_length=max_tokens)) as chunks:
+            for chunk in chunks:
+                yield f"data: {json.dumps({'token': chunk})}\n\n"
+        
+        processing_time = round(time.time() - start_time, 2)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Streamed consultation completed in %ss for: %.50s...", processing_time, question)
+        
+        yield f"data: {json.dumps({'done': True, 'category': category, 'processing_time': processing_time, 'timestamp': datetime.now().isoformat()})}\n\n"
+        
+    except Exception as e:
+        logger.error(f"Error streaming consultation: {str(e)}")
+        yield f"data: {json.dumps({'error': f'Failed to process request: {str(e)}'})}\n\n"
+
 @app.route('/api/batch-consult', methods=['POST'])
 def batch_consult():
     """API endpoint for batch business consulting questions"""
-    if shutdown_flag:
+    if consultant.is_shutting_down:
         return jsonify({'error': 'Service is shutting down'}), 503
     
     try:
@@ -105,14 +155,17 @@ def batch_consult():
             return jsonify({'error': 'Questions array is required'}), 400
         
         # Validate category
-        valid_categories = ['general', 'finance', 'marketing', 'operations', 'hr']
-        if category not in valid_categories:
+        if category not in VALID_CATEGORIES:
             category = 'general'
         
+        max_tokens = parse_max_tokens(data.get('max_tokens', DEFAULT_MAX_TOKENS))
+        if max_tokens is None:
+            return jsonify({'error': 'max_tokens must be a positive integer'}), 400
+        
         start_time = time.time()
         
         # Generate responses for all questions
-        responses = consultant.batch_generate(questions, category)
+        responses = consultant.batch_generate(questions, category, max_length=max_tokens)
         
         end_time = time.time()
         processing_time = round(end_time - start_time, 2)
@@ -125,7 +178,7 @@ def batch_consult():
                 'index': i
             })
         
-        logger.info(f"Batch consultation completed for {len(questions)} questions")
+        logger.info("Batch consultation completed for %d questions", len(questions))
         
         return jsonify({
             'results': results,
@@ -135,6 +188,8 @@ def batch_consult():
             'timestamp': datetime.now().isoformat()
         })
         
+    except ServiceShuttingDown:
+        return jsonify({'error': 'Service is shutting down'}), 503
     except Exception as e:
         error_msg = f"Error processing batch consultation: {str(e)}"
         logger.error(error_msg)
@@ -143,7 +198,7 @@ def batch_consult():
 @app.route('/api/model-info', methods=['GET'])
 def model_info():
     """API endpoint to get model information"""
-    if shutdown_flag:
+    if consultant.is_shutting_down:
         return jsonify({'error': 'Service is shutting down'}), 503
     
     try:
@@ -181,6 +236,9 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
+    # Make SIGTERM (e.g. `docker stop`) a normal exit so the atexit cleanup runs
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    
     # Run the Flask app
     logger.info("Starting Flask application...")
     app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
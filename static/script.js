@@ -58,33 +58,79 @@ document.addEventListener('DOMContentLoaded', function() {
         // Show typing indicator
         const typingIndicator = addTypingIndicator();
         
-        // Send request to backend
-        fetch(`/api/consult?question=${encodeURIComponent(question)}&category=${category}`)
-            .then(response => response.json())
-            .then(data => {
-                // Remove typing indicator
-                if (typingIndicator.parentNode) {
-                    typingIndicator.parentNode.removeChild(typingIndicator);
+        // Send request to backend and stream the answer as it is generated
+        // (streamed requests skip the server-side request batcher: faster first word, lower peak throughput)
+        fetch(`/api/consult?question=${encodeURIComponent(question)}&category=${category}&stream=1`)
+            .then(response => {
+                const contentType = response.headers.get('Content-Type') || '';
+                if (!contentType.includes('text/event-stream')) {
+                    // Validation errors come back as plain JSON
+                    return response.json().then(data => {
+                        removeTypingIndicator(typingIndicator);
+                        addMessageToChat(`Error: ${data.error}`, 'ai');
+                    });
+                }
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                let answer = '';
+                let messageElement = null;
+                
+                function handleEvent(event) {
+                    if (!event.startsWith('data: ')) {
+                        return;
+                    }
+                    const data = JSON.parse(event.slice(6));
+                    
+                    if (data.error) {
+                        removeTypingIndicator(typingIndicator);
+                        addMessageToChat(`Error: ${data.error}`, 'ai');
+                    } else if (data.token) {
+                        answer += data.token;
+                        if (messageElement) {
+                            updateMessageContent(messageElement, answer);
+                        } else {
+                            // Replace the typing indicator with the first token
+                            removeTypingIndicator(typingIndicator);
+                            messageElement = addMessageToChat(answer, 'ai');
+                        }
+                    }
                 }
                 
-                // Add AI response to chat
-                if (data.error) {
-                    addMessageToChat(`Error: ${data.error}`, 'ai');
-                } else {
-                    addMessageToChat(data.answer, 'ai');
+                function read() {
+                    return reader.read().then(({ done, value }) => {
+                        if (done) {
+                            removeTypingIndicator(typingIndicator);
+                            return;
+                        }
+                        
+                        buffer += decoder.decode(value, { stream: true });
+                        const events = buffer.split('\n\n');
+                        buffer = events.pop();
+                        events.forEach(handleEvent);
+                        return read();
+                    });
                 }
+                
+                return read();
             })
             .catch(error => {
                 // Remove typing indicator
-                if (typingIndicator.parentNode) {
-                    typingIndicator.parentNode.removeChild(typingIndicator);
-                }
+                removeTypingIndicator(typingIndicator);
                 
                 // Add error message to chat
                 addMessageToChat(`Network error: ${error.message}`, 'ai');
             });
     }
     
+    // Function to remove the typing indicator if it is still shown
+    function removeTypingIndicator(typingIndicator) {
+        if (typingIndicator.parentNode) {
+            typingIndicator.parentNode.removeChild(typingIndicator);
+        }
+    }
+    
     // Function to add message to chat
     function addMessageToChat(message, sender) {
         const messageElement = document.createElement('div');
@@ -104,6 +150,14 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Scroll to bottom
         chatMessages.scrollTop = chatMessages.scrollHeight;
+        
+        return messageElement;
+    }
+    
+    // Function to replace the content of a message already in the chat
+    function updateMessageContent(messageElement, message) {
+        messageElement.querySelector('.message-content').innerHTML = formatMessage(message);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
     }
     
     // Function to add typing indicator